@@ -1,127 +1,493 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, session
 import os
-import json
+import io
+import tempfile
+import functools
+import bisect
+import pickle
+import orjson
+import numpy as np
 import pandas as pd
 import requests
+import httpx
+import upstox_client
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import secrets
 from flask_apscheduler import APScheduler
+from jinja2 import FileSystemBytecodeCache
 
 # Initialize Flask app
 app = Flask(__name__)
 app.secret_key = secrets.token_hex(16)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
-app.config['ALLOWED_EXTENSIONS'] = {'xlsx', 'xls'}
+app.config['ALLOWED_EXTENSIONS'] = {'xlsx', 'xls', 'csv'}
+app.config['SCHEDULER_API_ENABLED'] = False
+
+# Reuse compiled template bytecode across renders and restarts. Jinja's default
+# directory is private to the current user, so other users can't plant bytecode.
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
 
 # Initialize scheduler
 scheduler = APScheduler()
 scheduler.init_app(app)
-scheduler.start()
+
+scheduler_lock = threading.Lock()
+
+def start_scheduler():
+    """Start the scheduler once per process; safe to call from every launcher"""
+    with scheduler_lock:
+        if not scheduler.running:
+            scheduler.start()
+
+# The debug reloader's watcher process imports the app too; leave the scheduler to its
+# serving child there. Debug launches without the reloader start it explicitly via
+# __main__ or the Gunicorn config.
+if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    start_scheduler()
+
+# Instrument mapping source and its pickled cache
+INSTRUMENT_FILE = 'NSE.json'
+INSTRUMENT_CACHE_FILE = 'NSE.pkl'
+
+# Append-only JSON lines log of full order responses
+ORDER_LOG_FILE = 'orders.log'
+order_log_lock = threading.Lock()
+
+# Shared HTTP session so Upstox calls reuse pooled keep-alive connections
+UPSTOX_TIMEOUT = 5
+LTP_BATCH_SIZE = 50  # Instruments per market-quote request
+ORDER_CONCURRENCY = 32  # In-flight order placements per uploaded sheet
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+))
 
 # Create uploads folder if it doesn't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Default values for optional order sheet columns
+ORDER_DEFAULTS = {
+    'symbol': '',
+    'instrument_token': np.nan,
+    'transaction_type': 'BUY',
+    'quantity': 1,
+    'price': 0.0,
+    'order_type': 'MARKET',
+    'product': 'I',  # Intraday
+    'validity': 'DAY',
+    'tag': 'excel-order',
+    'disclosed_quantity': 0,
+    'trigger_price': 0.0,
+    'is_amo': False,
+    'stop_loss_price': np.nan
+}
+
+# Columns whose defaults apply only when the column is missing; blank cells skip the row
+ORDER_REQUIRED_COLUMNS = ('transaction_type', 'quantity', 'price')
+
+# Numeric order sheet columns; rows with unparseable values in these are skipped
+ORDER_NUMERIC_COLUMNS = ('quantity', 'price', 'disclosed_quantity', 'trigger_price')
+
+# Every column a row must have a valid value in before its order is placed
+ORDER_CHECKED_COLUMNS = ('transaction_type',) + ORDER_NUMERIC_COLUMNS
+
+class ShardedDict:
+    """Dict split into independently locked shards so unrelated keys don't contend"""
+    
+    def __init__(self, shards=16):
+        self._shards = [{} for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+    
+    def _index(self, key):
+        return hash(key) % len(self._shards)
+    
+    def __getitem__(self, key):
+        i = self._index(key)
+        with self._locks[i]:
+            return self._shards[i][key]
+    
+    def __setitem__(self, key, value):
+        i = self._index(key)
+        with self._locks[i]:
+            self._shards[i][key] = value
+    
+    def __delitem__(self, key):
+        i = self._index(key)
+        with self._locks[i]:
+            del self._shards[i][key]
+    
+    def __contains__(self, key):
+        i = self._index(key)
+        with self._locks[i]:
+            return key in self._shards[i]
+    
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+    
+    def __iter__(self):
+        return iter([key for key, _ in self.items()])
+    
+    def get(self, key, default=None):
+        i = self._index(key)
+        with self._locks[i]:
+            return self._shards[i].get(key, default)
+    
+    def pop(self, key, default=None):
+        i = self._index(key)
+        with self._locks[i]:
+            return self._shards[i].pop(key, default)
+    
+    def items(self):
+        """Return a snapshot list of (key, value) pairs, taking each shard lock in turn"""
+        snapshot = []
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                snapshot.extend(shard.items())
+        return snapshot
+    
+    def to_dict(self):
+        return dict(self.items())
+
 # Global variables
-active_orders = {}
-stop_loss_orders = {}
+active_orders = ShardedDict()
+stop_loss_orders = ShardedDict()
 instrument_mapping = {}
+instrument_mapping_version = 0  # Bumped on every reload to invalidate cached views
+instrument_index = (np.array([], dtype=str), np.array([], dtype=np.int64))  # Sorted symbols, matching tokens
+
+# Stop loss sells run on a small pool so detection never waits on order placement
+stop_loss_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='sl-exec')
+in_flight_stop_losses = set()
+in_flight_lock = threading.Lock()
+
+# Live price feed state
+latest_prices = {}
+trigger_table = {}  # Instrument token -> sorted [(stop_loss_price, order_id)]
+trigger_ceilings = {}  # Instrument token -> highest stop loss price, readable without the lock
+trigger_lock = threading.Lock()
+watched_tokens = set()
+price_streamer = None
+price_feed_token = None  # Access token the current feed was opened with
+price_feed_open = False
+feed_lock = threading.Lock()
+
+def file_extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+    return file_extension(filename) in app.config['ALLOWED_EXTENSIONS']
+
+def build_instrument_index(mapping):
+    """Pack a symbol -> token mapping into sorted parallel numpy arrays for binary search"""
+    symbols = np.array(sorted(mapping), dtype=str)
+    tokens = np.array([mapping[symbol] for symbol in symbols], dtype=np.int64)
+    return symbols, tokens
+
+def lookup_instrument_tokens(symbols):
+    """Map an array of normalized symbols to tokens at once, with NaN for unknown symbols"""
+    index_symbols, index_tokens = instrument_index
+    symbols = np.asarray(symbols, dtype=str)
+    if len(index_symbols) == 0:
+        return np.full(len(symbols), np.nan)
+    
+    positions = np.minimum(np.searchsorted(index_symbols, symbols), len(index_symbols) - 1)
+    found = index_symbols[positions] == symbols
+    return np.where(found, index_tokens[positions], np.nan)
 
 def load_instrument_mapping():
-    global instrument_mapping
+    global instrument_mapping, instrument_index, instrument_mapping_version
+    if not os.path.exists(INSTRUMENT_FILE):
+        return
+    
+    # Reuse the pickled mapping while it is at least as new as the JSON source
+    mapping = None
+    if (os.path.exists(INSTRUMENT_CACHE_FILE)
+            and os.path.getmtime(INSTRUMENT_CACHE_FILE) >= os.path.getmtime(INSTRUMENT_FILE)):
+        try:
+            with open(INSTRUMENT_CACHE_FILE, 'rb') as f:
+                mapping = pickle.load(f)
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable instrument mapping cache: {e}")
+    from_cache = mapping is not None
+    
     try:
-        if os.path.exists('NSE.json'):
-            with open('NSE.json', 'r') as f:
-                data = json.load(f)
-                for item in data:
-                    if 'symbol' in item and 'instrument_token' in item:
-                        instrument_mapping[item['symbol'].strip().upper()] = int(item['instrument_token'])
-            print(f"✅ Loaded {len(instrument_mapping)} instrument mappings")
+        if not from_cache:
+            with open(INSTRUMENT_FILE, 'rb') as f:
+                data = orjson.loads(f.read())
+            mapping = {item['symbol'].strip().upper(): int(item['instrument_token'])
+                       for item in data
+                       if 'symbol' in item and 'instrument_token' in item}
+        instrument_mapping = mapping
+        instrument_index = build_instrument_index(instrument_mapping)
+        instrument_mapping_version += 1
+        print(f"✅ Loaded {len(instrument_mapping)} instrument mappings")
     except Exception as e:
         print(f"⚠️ Error loading instrument mapping: {e}")
+        return
+    
+    # The cache is only an optimization; a read-only working directory must not break loading
+    if not from_cache:
+        save_instrument_cache(instrument_mapping)
+
+def save_instrument_cache(mapping):
+    """Atomically replace the pickled instrument mapping so a failed write never leaves a truncated cache"""
+    cache_dir = os.path.dirname(os.path.abspath(INSTRUMENT_CACHE_FILE))
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.NSE-', suffix='.pkl.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(mapping, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, INSTRUMENT_CACHE_FILE)
+    except Exception as e:
+        print(f"⚠️ Error writing instrument mapping cache: {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 # Load instrument mapping on startup
 load_instrument_mapping()
 
-def get_instrument_token(symbol):
-    """Get instrument token for a given symbol"""
-    if not symbol:
-        return None
+def add_stop_loss(order_id, order):
+    """Register a stop loss and index it in the trigger table"""
+    stop_loss_orders[order_id] = order
+    token = order['instrument_token']
+    with trigger_lock:
+        entries = trigger_table.setdefault(token, [])
+        bisect.insort(entries, (float(order['stop_loss_price']), order_id))
+        trigger_ceilings[token] = entries[-1][0]
+
+def remove_stop_loss(order_id):
+    """Stop monitoring a stop loss and drop it from the trigger table"""
+    order = stop_loss_orders.pop(order_id, None)
+    if order is None:
+        return
     
-    symbol = symbol.strip().upper()
-    return instrument_mapping.get(symbol)
+    token = order['instrument_token']
+    entry = (float(order['stop_loss_price']), order_id)
+    with trigger_lock:
+        entries = trigger_table.get(token, [])
+        i = bisect.bisect_left(entries, entry)
+        if i < len(entries) and entries[i] == entry:
+            entries.pop(i)
+        if entries:
+            trigger_ceilings[token] = entries[-1][0]
+        else:
+            trigger_table.pop(token, None)
+            trigger_ceilings.pop(token, None)
+
+def triggered_stop_losses(token, current_price):
+    """Return the IDs of stop losses on an instrument whose threshold the price has breached"""
+    with trigger_lock:
+        entries = trigger_table.get(token)
+        if not entries:
+            return []
+        # Entries are sorted by price, so every threshold >= current_price sits in the tail
+        i = bisect.bisect_left(entries, (current_price,))
+        return [order_id for _, order_id in entries[i:]]
+
+def stop_loss_access_token():
+    """Get the access token of an active stop loss (assuming all use same token)"""
+    # Probe the trigger table instead of snapshotting every stop loss order
+    with trigger_lock:
+        for entries in trigger_table.values():
+            order = stop_loss_orders.get(entries[0][1])
+            if order and order.get('access_token'):
+                return order['access_token']
+    return None
 
 def check_stop_losses():
     """Check all active stop losses and execute if needed"""
-    if not stop_loss_orders:
+    with trigger_lock:
+        tokens_to_check = list(trigger_table)
+    if not tokens_to_check:
         return
     
     print(f"🔍 Checking {len(stop_loss_orders)} stop loss orders...")
     
-    # Get access token from the first stop loss order (assuming all use same token)
-    first_order_id = next(iter(stop_loss_orders))
-    access_token = stop_loss_orders[first_order_id].get('access_token')
-    
+    access_token = stop_loss_access_token()
     if not access_token:
         print("⚠️ No access token available for stop loss checks")
         return
     
-    # Group orders by instrument token to batch price checks
-    tokens_to_check = {}
-    for order_id, order in stop_loss_orders.items():
-        token = order.get('instrument_token')
-        if token:
-            if token not in tokens_to_check:
-                tokens_to_check[token] = []
-            tokens_to_check[token].append(order_id)
-    
-    # Check current prices
-    for token, order_ids in tokens_to_check.items():
+    # Fetch prices for all instruments in one batched request
+    current_prices = get_current_prices(tokens_to_check, access_token)
+    
+    for token, current_price in current_prices.items():
         try:
-            # Get current price for this instrument
-            current_price = get_current_price(token, access_token)
-            
-            if current_price is None:
+            execute_triggered_stop_losses(token, current_price)
+        except Exception as e:
+            print(f"⚠️ Error checking price for token {token}: {e}")
+
+def execute_triggered_stop_losses(token, current_price):
+    """Execute every stop loss on an instrument that the given price has breached"""
+    for order_id in triggered_stop_losses(token, current_price):
+        with in_flight_lock:
+            # Skip orders whose sell is already queued from an earlier tick
+            if order_id in in_flight_stop_losses:
                 continue
+            in_flight_stop_losses.add(order_id)
+        
+        # Look up only after claiming: an executed order is removed before it is released,
+        # so a missing order here means it has already been sold
+        order = stop_loss_orders.get(order_id)
+        if order is None:
+            release_stop_loss(order_id)
+            continue
+        
+        print(f"🚨 Stop loss triggered for order {order_id}: Current price {current_price} <= Stop loss {order['stop_loss_price']}")
+        # Execute the sell order off the checking thread
+        future = stop_loss_executor.submit(execute_stop_loss, order_id, order, current_price)
+        future.add_done_callback(lambda _, order_id=order_id: release_stop_loss(order_id))
+
+def release_stop_loss(order_id):
+    """Allow a stop loss to be submitted again once its execution attempt finishes"""
+    with in_flight_lock:
+        in_flight_stop_losses.discard(order_id)
+
+def get_current_prices(instrument_tokens, access_token):
+    """Get current market prices for several instrument tokens, batching the LTP requests"""
+    prices = {}
+    headers = {
+        'Accept': 'application/json',
+        'Authorization': f'Bearer {access_token}'
+    }
+    
+    for start in range(0, len(instrument_tokens), LTP_BATCH_SIZE):
+        batch = instrument_tokens[start:start + LTP_BATCH_SIZE]
+        try:
+            url = f"https://api.upstox.com/v2/market-quote/ltp?instrument_token={','.join(map(str, batch))}"
+            response = SESSION.get(url, headers=headers, timeout=UPSTOX_TIMEOUT)
+            data = response.json()
+            
+            if response.status_code == 200 and 'data' in data:
+                quotes = data['data']
+                for token in batch:
+                    quote = quotes.get(str(token))
+                    if quote and quote.get('last_price') is not None:
+                        prices[token] = quote['last_price']
+            else:
+                print(f"⚠️ Failed to get prices for {len(batch)} instruments: {data.get('message', 'Unknown error')}")
+        except Exception as e:
+            print(f"⚠️ Error getting prices: {e}")
+    
+    return prices
+
+def refresh_price_feed(access_token=None):
+    """Subscribe the market data feed to every instrument with an active stop loss"""
+    # Also (re)starts the feed when it is down or a newer access token arrives, and
+    # retries subscriptions that failed or were requested before the socket opened
+    global price_streamer, price_feed_token, price_feed_open
+    with trigger_lock:
+        tokens = set(trigger_table)
+    if not tokens:
+        return
+    
+    with feed_lock:
+        try:
+            if price_streamer is None or (access_token and access_token != price_feed_token):
+                access_token = access_token or price_feed_token or stop_loss_access_token()
+                if not access_token:
+                    return
+                if price_streamer is not None:
+                    try:
+                        price_streamer.disconnect()
+                    except Exception as e:
+                        print(f"⚠️ Error closing previous price feed: {e}")
                 
-            # Check each order with this instrument
-            for order_id in order_ids:
-                order = stop_loss_orders[order_id]
-                stop_loss_price = order.get('stop_loss_price')
+                configuration = upstox_client.Configuration()
+                configuration.access_token = access_token
+                streamer = upstox_client.MarketDataStreamer(
+                    upstox_client.ApiClient(configuration), [str(token) for token in tokens], 'ltpc')
+                streamer.on('message', on_price_feed_message)
+                streamer.on('open', lambda *_: on_price_feed_open(streamer))
+                streamer.on('close', lambda *_: on_price_feed_closed(streamer))
+                streamer.on('autoReconnectStopped', lambda *_: on_price_feed_stopped(streamer))
                 
-                if stop_loss_price and current_price <= float(stop_loss_price):
-                    print(f"🚨 Stop loss triggered for order {order_id}: Current price {current_price} <= Stop loss {stop_loss_price}")
-                    # Execute the sell order
-                    execute_stop_loss(order_id, order, current_price)
+                price_streamer = streamer
+                price_feed_token = access_token
+                price_feed_open = False
+                watched_tokens.clear()
+                watched_tokens.update(tokens)
+                # connect() returns once the SDK has started its own socket thread
+                streamer.connect()
+                print(f"📡 Started price feed for {len(tokens)} instruments")
+                return
+            
+            # Instruments added before the socket opened are picked up once it does
+            new_tokens = tokens - watched_tokens
+            if not new_tokens or not price_feed_open:
+                return
+            price_streamer.subscribe([str(token) for token in new_tokens], 'ltpc')
+            watched_tokens.update(new_tokens)
+            print(f"📡 Subscribed price feed to {len(new_tokens)} instruments")
         except Exception as e:
-            print(f"⚠️ Error checking price for token {token}: {e}")
+            print(f"⚠️ Error refreshing price feed: {e}")
+
+def on_price_feed_open(streamer):
+    """Mark the feed live and resubscribe everything, including after a reconnect"""
+    global price_feed_open
+    with feed_lock:
+        if streamer is not price_streamer:
+            return
+        price_feed_open = True
+        watched_tokens.clear()
+    refresh_price_feed()
+
+def on_price_feed_closed(streamer):
+    """Hold back subscriptions until the feed reconnects"""
+    global price_feed_open
+    with feed_lock:
+        if streamer is price_streamer:
+            price_feed_open = False
+
+def on_price_feed_stopped(streamer):
+    """Drop a feed that gave up reconnecting so the next refresh starts a new one"""
+    global price_streamer, price_feed_open
+    with feed_lock:
+        if streamer is price_streamer:
+            price_streamer = None
+            price_feed_open = False
+            watched_tokens.clear()
+            print("⚠️ Price feed stopped reconnecting; it will be restarted on the next check")
 
-def get_current_price(instrument_token, access_token):
-    """Get current market price for a given instrument token"""
+def on_price_feed_message(message):
+    """Handle a decoded market data feed message"""
+    for key, feed in message.get('feeds', {}).items():
+        try:
+            ltp = feed.get('ltpc', {}).get('ltp')
+            if ltp is None:
+                continue
+            on_price_tick(int(key), float(ltp))
+        except Exception as e:
+            print(f"⚠️ Error handling price tick for {key}: {e}")
+
+def on_price_tick(token, current_price):
+    """Record a live price and execute any stop losses it breaches"""
+    latest_prices[token] = current_price
+    
+    # Most ticks breach nothing; settle those with one dict read instead of taking the trigger lock
+    if current_price > trigger_ceilings.get(token, float('-inf')):
+        return
+    
+    execute_triggered_stop_losses(token, current_price)
+
+def log_order_response(order_id, result):
+    """Append a raw Upstox order response to the audit log as one JSON line"""
+    line = orjson.dumps({'ts': datetime.now().isoformat(), 'id': order_id, 'resp': result}) + b'\n'
     try:
-        url = f"https://api.upstox.com/v2/market-quote/ltp?instrument_token={instrument_token}"
-        headers = {
-            'Accept': 'application/json',
-            'Authorization': f'Bearer {access_token}'
-        }
-        
-        response = requests.get(url, headers=headers)
-        data = response.json()
-        
-        if response.status_code == 200 and 'data' in data:
-            return data['data'].get(str(instrument_token), {}).get('last_price')
-        else:
-            print(f"⚠️ Failed to get price for {instrument_token}: {data.get('message', 'Unknown error')}")
-            return None
+        with order_log_lock, open(ORDER_LOG_FILE, 'ab') as f:
+            f.write(line)
     except Exception as e:
-        print(f"⚠️ Error getting price: {e}")
-        return None
+        print(f"⚠️ Error writing order log for {order_id}: {e}")
 
 def execute_stop_loss(order_id, order, current_price):
     """Execute a stop loss order"""
@@ -146,19 +512,19 @@ def execute_stop_loss(order_id, order, current_price):
             "is_amo": False
         }
         
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
+        response = SESSION.post(url, headers=headers, data=orjson.dumps(payload), timeout=UPSTOX_TIMEOUT)
         result = response.json()
         
         order['stop_loss_executed'] = True
         order['execution_price'] = current_price
         order['execution_time'] = datetime.now().isoformat()
-        order['execution_response'] = result
+        order['execution_status'] = result.get('status')
+        log_order_response(order_id, result)
         
         print(f"✅ Executed stop loss for order {order_id}: {result}")
         
         # Remove from active stop losses
-        if order_id in stop_loss_orders:
-            del stop_loss_orders[order_id]
+        remove_stop_loss(order_id)
     except Exception as e:
         print(f"⚠️ Error executing stop loss for order {order_id}: {e}")
 
@@ -189,23 +555,84 @@ def upload_file():
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        data = file.read()
         
-        # Process the file in a separate thread
-        thread = threading.Thread(target=process_excel_file, args=(filepath, access_token))
+        # Process the file in a separate thread straight from memory
+        # The extension comes from the validated original name; secure_filename can strip it
+        thread = threading.Thread(target=process_excel_file,
+                                  args=(data, access_token, file_extension(file.filename), filename))
         thread.start()
         
+        # Keep an audit copy without delaying order placement
+        threading.Thread(target=save_upload, args=(filepath, data)).start()
+        
         flash('File uploaded and processing started', 'success')
         return redirect(url_for('index'))
     
     flash('Invalid file type', 'error')
     return redirect(request.url)
 
-def process_excel_file(filepath, access_token):
-    """Process uploaded Excel file and place orders"""
+def prepare_order_frame(df):
+    """Normalize an uploaded order sheet column-wise and resolve instrument tokens"""
+    df.columns = df.columns.str.strip().str.lower()
+    
+    # Fill in missing columns with their defaults, and blank cells of optional ones
+    for column, default in ORDER_DEFAULTS.items():
+        if column not in df.columns:
+            df[column] = default
+        elif column not in ORDER_REQUIRED_COLUMNS:
+            df[column] = df[column].fillna(default)
+    
+    df['symbol'] = df['symbol'].astype(str).str.strip()
+    for column in ('order_type', 'product'):
+        df[column] = df[column].astype(str).str.strip().str.upper()
+    # Blank transaction types stay NaN so their rows are skipped rather than defaulted to BUY
+    transaction_types = df['transaction_type'].astype(str).str.strip().str.upper()
+    df['transaction_type'] = transaction_types.where(df['transaction_type'].notna() & (transaction_types != ''))
+    # Bad cells become NaN so only their rows are skipped, not the whole sheet
+    for column in ORDER_NUMERIC_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+    df['is_amo'] = df['is_amo'].astype(bool)
+    df['stop_loss_price'] = pd.to_numeric(df['stop_loss_price'], errors='coerce')
+    
+    # Map symbols to tokens where the sheet doesn't provide one
+    tokens = pd.to_numeric(df['instrument_token'], errors='coerce').replace(0, np.nan)
+    mapped = lookup_instrument_tokens(df['symbol'].str.upper().to_numpy())
+    df['instrument_token'] = tokens.fillna(pd.Series(mapped, index=df.index))
+    return df
+
+async def place_orders(url, headers, payloads):
+    """Place orders concurrently over one HTTP/2 client, returning responses or exceptions in input order"""
+    semaphore = asyncio.Semaphore(ORDER_CONCURRENCY)
+    limits = httpx.Limits(max_connections=64, max_keepalive_connections=64)
+    
+    async with httpx.AsyncClient(http2=True, limits=limits, timeout=UPSTOX_TIMEOUT) as client:
+        async def place(payload):
+            async with semaphore:
+                response = await client.post(url, headers=headers, content=orjson.dumps(payload))
+                return response.json()
+        
+        return await asyncio.gather(*[place(payload) for payload in payloads], return_exceptions=True)
+
+def save_upload(filepath, data):
+    """Write an uploaded file to disk for auditing"""
+    try:
+        with open(filepath, 'wb') as f:
+            f.write(data)
+    except Exception as e:
+        print(f"⚠️ Error saving upload {filepath}: {e}")
+
+def read_order_sheet(data, extension):
+    """Parse uploaded order sheet contents into a DataFrame"""
+    if extension == 'csv':
+        # CSV skips workbook parsing entirely
+        return pd.read_csv(io.BytesIO(data))
+    return pd.read_excel(io.BytesIO(data))
+
+def process_excel_file(data, access_token, extension, filename='upload'):
+    """Process uploaded Excel or CSV order sheet contents and place orders"""
     try:
-        df = pd.read_excel(filepath)
-        df.columns = df.columns.str.strip().str.lower()
+        df = prepare_order_frame(read_order_sheet(data, extension))
         
         url = "https://api.upstox.com/v2/order/place"
         headers = {
@@ -213,116 +640,124 @@ def process_excel_file(filepath, access_token):
             'Authorization': f'Bearer {access_token}'
         }
         
-        for index, row in df.iterrows():
+        # Build all payloads up front so the orders can be placed concurrently
+        pending = []
+        for row in df.itertuples():
+            index = row.Index
+            if pd.isna(row.instrument_token):
+                print(f"⚠️ Skipping row {index+1}: Missing or invalid instrument token for symbol '{row.symbol}'")
+                continue
+            
+            invalid = [column for column in ORDER_CHECKED_COLUMNS if pd.isna(getattr(row, column))]
+            if invalid:
+                print(f"⚠️ Skipping row {index+1}: Invalid value for {', '.join(invalid)}")
+                continue
+            
+            payload = {
+                "quantity": int(row.quantity),
+                "product": row.product,
+                "validity": row.validity,
+                "price": float(row.price),
+                "tag": row.tag,
+                "instrument_token": int(row.instrument_token),
+                "order_type": row.order_type,
+                "transaction_type": row.transaction_type,
+                "disclosed_quantity": int(row.disclosed_quantity),
+                "trigger_price": float(row.trigger_price),
+                "is_amo": row.is_amo
+            }
+            pending.append((index, row, payload))
+        
+        # Place every order concurrently, then record results from this thread only
+        results = asyncio.run(place_orders(url, headers, [payload for _, _, payload in pending]))
+        
+        for (index, row, payload), result in zip(pending, results):
             try:
-                symbol = row.get('symbol', '')
-                instrument_token = row.get('instrument_token')
-                
-                # Try to map symbol to token if not provided
-                if not instrument_token and symbol:
-                    instrument_token = get_instrument_token(symbol)
-                
-                if not instrument_token:
-                    print(f"⚠️ Skipping row {index+1}: Missing or invalid instrument token for symbol '{symbol}'")
-                    continue
-                
-                # Extract order details
-                transaction_type = row.get('transaction_type', 'BUY').upper()
-                quantity = int(row.get('quantity', 1))
-                price = float(row.get('price', 0))
-                order_type = row.get('order_type', 'MARKET').upper()
-                product = row.get('product', 'I').upper()  # Default to Intraday
-                
-                # Handle stop loss information
-                stop_loss_price = row.get('stop_loss_price', None)
-                
-                # Create order payload
-                payload = {
-                    "quantity": quantity,
-                    "product": product,
-                    "validity": row.get('validity', 'DAY'),
-                    "price": price,
-                    "tag": row.get('tag', 'excel-order'),
-                    "instrument_token": int(instrument_token),
-                    "order_type": order_type,
-                    "transaction_type": transaction_type,
-                    "disclosed_quantity": int(row.get('disclosed_quantity', 0)),
-                    "trigger_price": float(row.get('trigger_price', 0)),
-                    "is_amo": bool(row.get('is_amo', False))
-                }
-                
-                # Place the order
-                response = requests.post(url, headers=headers, data=json.dumps(payload))
-                result = response.json()
+                if isinstance(result, Exception):
+                    raise result
                 
                 # Generate a unique order ID
                 order_id = result.get('data', {}).get('order_id', f"manual-{int(time.time())}-{index}")
                 
-                # Store order information
+                # Store order information, keeping the full response only in the order log
+                log_order_response(order_id, result)
                 active_orders[order_id] = {
-                    'symbol': symbol,
-                    'instrument_token': instrument_token,
-                    'transaction_type': transaction_type,
-                    'quantity': quantity,
-                    'price': price,
-                    'order_type': order_type,
-                    'product': product,
+                    'symbol': row.symbol,
+                    'instrument_token': payload['instrument_token'],
+                    'transaction_type': row.transaction_type,
+                    'quantity': payload['quantity'],
+                    'price': payload['price'],
+                    'order_type': row.order_type,
+                    'product': row.product,
                     'time': datetime.now().isoformat(),
                     'status': 'placed',
-                    'response': result,
+                    'response_status': result.get('status'),
+                    'remote_order_id': result.get('data', {}).get('order_id'),
                     'access_token': access_token  # Store token for later use
                 }
                 
                 # If it's a BUY order and has stop loss, add to stop loss monitoring
-                if transaction_type == 'BUY' and stop_loss_price is not None:
-                    stop_loss_orders[order_id] = {
-                        'symbol': symbol,
-                        'instrument_token': instrument_token,
-                        'quantity': quantity,
-                        'product': product,
-                        'stop_loss_price': float(stop_loss_price),
-                        'buy_price': price,
+                if row.transaction_type == 'BUY' and not pd.isna(row.stop_loss_price):
+                    add_stop_loss(order_id, {
+                        'symbol': row.symbol,
+                        'instrument_token': payload['instrument_token'],
+                        'quantity': payload['quantity'],
+                        'product': row.product,
+                        'stop_loss_price': float(row.stop_loss_price),
+                        'buy_price': payload['price'],
                         'access_token': access_token
-                    }
+                    })
                 
                 print(f"✅ Order {index+1} placed: {result}")
                 
             except Exception as e:
                 print(f"⚠️ Error processing row {index+1}: {e}")
                 continue
+        
+        # Start watching live prices for any newly added stop losses
+        refresh_price_feed(access_token)
                 
     except Exception as e:
-        print(f"⚠️ Error processing file {filepath}: {e}")
+        print(f"⚠️ Error processing order sheet {filename}: {e}")
 
 @app.route('/orders')
 def view_orders():
     return render_template('orders.html', 
-                          active_orders=active_orders, 
-                          stop_loss_orders=stop_loss_orders)
+                          active_orders=active_orders.to_dict(), 
+                          stop_loss_orders=stop_loss_orders.to_dict())
 
-@app.route('/mapping')
-def view_mapping():
+@functools.lru_cache(maxsize=1)
+def render_mapping_page(version):
+    """Render the mapping page once per loaded version of the instrument mapping"""
     # Convert dict to list of dicts for easier template rendering
     mappings = [{'symbol': symbol, 'token': token} 
                for symbol, token in instrument_mapping.items()]
     return render_template('mapping.html', mappings=mappings)
 
+@app.route('/mapping')
+def view_mapping():
+    return render_mapping_page(instrument_mapping_version)
+
 @app.route('/api/orders')
 def api_orders():
-    return jsonify({
-        'active_orders': active_orders,
-        'stop_loss_orders': stop_loss_orders,
+    body = orjson.dumps({
+        'active_orders': active_orders.to_dict(),
+        'stop_loss_orders': stop_loss_orders.to_dict(),
         'counts': {
             'active': len(active_orders),
             'stop_loss': len(stop_loss_orders)
         }
     })
+    return Response(body, mimetype='application/json')
 
-# Schedule stop loss checker to run every minute
+# Poll stop losses every minute as a fallback to the live price feed
 @scheduler.task('interval', id='check_stop_losses', seconds=60)
 def scheduled_check_stop_losses():
     with app.app_context():
+        # Restart a dead feed and retry any subscriptions that didn't go through
+        refresh_price_feed()
         check_stop_losses()
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    start_scheduler()
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,28 @@
+# Gunicorn configuration for running StockTrader in production:
+#   gunicorn -c gunicorn_conf.py app:app
+
+# Listen on localhost only: /api/orders is unauthenticated and exposes access
+# tokens, so put a reverse proxy (with auth and TLS) in front for remote access.
+bind = '127.0.0.1:5000'
+
+# Orders, stop losses and the scheduler live in process memory, so exactly one
+# worker process must serve the app; concurrency comes from its thread pool.
+workers = 1
+worker_class = 'gthread'
+threads = 32
+
+# The app starts background threads (scheduler, price feed) at import time.
+# Threads don't survive fork, so the app is loaded inside the worker instead of
+# being preloaded in the master.
+preload_app = False
+
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+
+
+def post_worker_init(worker):
+    # Start the scheduler in the serving worker even when FLASK_DEBUG is set,
+    # which makes the import-time start defer to a reloader that isn't running
+    from app import start_scheduler
+    start_scheduler()